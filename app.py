@@ -5,7 +5,9 @@ With user authentication and captcha verification
 """
 
 from flask import Flask, render_template, jsonify, request, session, redirect, url_for, flash
+from flask_session import Session
 from functools import wraps
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import secrets
 import os
 
@@ -15,10 +17,60 @@ from captcha_generators.cloudflare_captcha import CloudflareCaptcha
 from captcha_generators.puzzle_captcha import PuzzleCaptcha
 from captcha_generators.audio_captcha import AudioCaptcha
 from captcha_generators.unsplash_client import unsplash_client
-from database import db, User, init_db
+from captcha_generators.image_cache import image_cache
+from database import db, User, init_db, constant_time_compare
+
+
+def _load_or_create_secret(path):
+    """Read the session secret from path, creating it (mode 0600) on first run"""
+    try:
+        with open(path) as f:
+            secret = f.read().strip()
+        if secret:
+            return secret
+    except FileNotFoundError:
+        pass
+    
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    secret = secrets.token_hex(32)
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        # Another worker created it first - use theirs unless it is still empty
+        with open(path) as f:
+            existing = f.read().strip()
+        if existing:
+            return existing
+        fd = os.open(path, os.O_WRONLY | os.O_TRUNC)
+    with os.fdopen(fd, 'w') as f:
+        f.write(secret)
+    return secret
+
+
+def _answers_match(submitted, expected):
+    """Constant-time comparison of a submitted captcha answer with the stored one"""
+    return constant_time_compare(str(submitted), str(expected))
+
 
 app = Flask(__name__)
-app.secret_key = secrets.token_hex(32)
+# Keep the key stable across restarts and workers so sessions stay valid
+app.secret_key = (os.environ.get('FLASK_SECRET_KEY')
+                  or _load_or_create_secret(os.path.join(app.instance_path, '.flask_secret')))
+
+# Keep captcha answers server-side; the cookie only carries an unsigned, random
+# session id (Flask-Session's use_signer is deprecated and left off)
+# Browser-session cookie as before, rather than Flask-Session's 31-day default
+app.config['SESSION_PERMANENT'] = False
+if os.environ.get('REDIS_URL'):
+    import redis
+    app.config['SESSION_TYPE'] = 'redis'
+    app.config['SESSION_REDIS'] = redis.from_url(os.environ['REDIS_URL'])
+else:
+    from cachelib import FileSystemCache
+    app.config['SESSION_TYPE'] = 'cachelib'
+    app.config['SESSION_CACHELIB'] = FileSystemCache(
+        os.path.join(app.instance_path, 'flask_session'), threshold=10000)
+Session(app)
 
 # Initialize database
 init_db(app)
@@ -103,11 +155,22 @@ def prefetch_images():
                      'mountain landscape', 'flower bloom', 'ocean sea waves', 
                      'dog pet', 'cat kitten', 'bird wildlife']
     
+    # Prefetching is network-bound, so fetch categories concurrently. Each category
+    # already downloads on 8 threads, so 2 at a time keeps us within the
+    # client's 16 pooled connections.
     results = {}
-    for category in categories:
-        unsplash_client.prefetch_category(category, count=count, size=(120, 120))
-        from captcha_generators.image_cache import image_cache
-        results[category] = image_cache.get_cache_count(category)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = {
+            executor.submit(unsplash_client.prefetch_category, category, count=count, size=(120, 120)): category
+            for category in categories
+        }
+        for future in as_completed(futures):
+            category = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Error prefetching '{category}': {e}")
+            results[category] = image_cache.get_cache_count(category)
     
     return jsonify({
         'success': True,
@@ -136,7 +199,6 @@ def set_cache_mode():
 @app.route('/api/cache/cleanup', methods=['POST'])
 def cleanup_cache():
     """Clean up expired cache entries"""
-    from captcha_generators.image_cache import image_cache
     image_cache.cleanup_all()
     
     return jsonify({
@@ -167,7 +229,7 @@ def verify_audio_captcha():
     user_answer = data.get('answer', '').strip()
     correct_answer = session.get('audio_captcha_answer', '')
     
-    if user_answer == correct_answer:
+    if _answers_match(user_answer, correct_answer):
         return jsonify({'success': True, 'message': 'Correct!'})
     else:
         return jsonify({'success': False, 'message': 'Incorrect. Try again.'})
@@ -194,7 +256,7 @@ def verify_text_captcha():
     user_answer = data.get('answer', '').upper()
     correct_answer = session.get('text_captcha_answer', '')
     
-    if user_answer == correct_answer:
+    if _answers_match(user_answer, correct_answer):
         return jsonify({'success': True, 'message': 'Correct!'})
     else:
         return jsonify({'success': False, 'message': 'Incorrect. Try again.'})
@@ -232,7 +294,7 @@ def verify_image_captcha():
     required = session.get('image_required_selections', 3)
     
     # Check if user selected exactly the right images
-    if sorted(selected_indices) == sorted(correct_indices):
+    if set(selected_indices) == set(correct_indices):
         return jsonify({'success': True, 'message': 'Correct! All images selected correctly.'})
     elif len(selected_indices) < required:
         return jsonify({'success': False, 'message': f'Please select {required} images.'})
@@ -434,15 +496,20 @@ def login():
     if not captcha_valid:
         return render_template('login.html', error='Invalid captcha. Please try again.')
     
-    # Find user
-    user = User.get_by_username_or_email(identifier)
+    # Find user and check password (unknown users still pay for a hash check)
+    user = User.authenticate(identifier, password)
     
-    if not user or not user.check_password(password):
+    if not user:
         return render_template('login.html', error='Invalid username/email or password.')
     
     if not user.is_active:
         return render_template('login.html', error='Account is deactivated.')
     
+    # Transparently upgrade legacy or low-cost hashes now that we know the password
+    if User.needs_rehash(user.password_hash):
+        db.session.get(User, user.id).set_password(password)
+        db.session.commit()
+    
     # Login successful
     session['user_id'] = user.id
     session['username'] = user.username
@@ -457,13 +524,13 @@ def verify_captcha(captcha_type, form_data):
     if captcha_type == 'text':
         captcha_answer = form_data.get('captcha_answer', '').upper()
         correct_captcha = session.get('text_captcha_answer', '')
-        return captcha_answer == correct_captcha
+        return _answers_match(captcha_answer, correct_captcha)
     
     elif captcha_type == 'image':
         try:
             selections = json.loads(form_data.get('image_selections', '[]'))
             correct_indices = session.get('image_captcha_answers', [])
-            return sorted(selections) == sorted(correct_indices)
+            return set(selections) == set(correct_indices)
         except:
             return False
     
@@ -483,7 +550,7 @@ def verify_captcha(captcha_type, form_data):
     elif captcha_type == 'audio':
         audio_answer = form_data.get('audio_answer', '').strip()
         correct_answer = session.get('audio_captcha_answer', '')
-        return audio_answer == correct_answer
+        return _answers_match(audio_answer, correct_answer)
     
     return False
 
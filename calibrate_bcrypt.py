@@ -0,0 +1,43 @@
+"""
+bcrypt Cost Calibration
+Finds the bcrypt work factor that takes at least ~250ms per hash on this host
+Set the result as BCRYPT_ROUNDS in the environment before starting the app
+"""
+
+import sys
+import time
+
+import bcrypt
+
+TARGET_SECONDS = 0.25
+MIN_ROUNDS = 10
+MAX_ROUNDS = 16
+
+
+def time_hash(rounds, samples=3):
+    """Return the fastest of a few hash timings at the given cost"""
+    salt = bcrypt.gensalt(rounds=rounds)
+    best = None
+    for _ in range(samples):
+        start = time.perf_counter()
+        bcrypt.hashpw(b'calibration-password', salt)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def calibrate(target=TARGET_SECONDS):
+    """Raise the cost until one hash takes at least target seconds"""
+    for rounds in range(MIN_ROUNDS, MAX_ROUNDS + 1):
+        elapsed = time_hash(rounds)
+        print(f"  rounds={rounds}: {elapsed * 1000:.0f} ms")
+        if elapsed >= target:
+            return rounds
+    return MAX_ROUNDS
+
+
+if __name__ == '__main__':
+    target = float(sys.argv[1]) if len(sys.argv) > 1 else TARGET_SECONDS
+    print(f"Calibrating bcrypt for >= {target * 1000:.0f} ms per hash...")
+    rounds = calibrate(target)
+    print(f"\nBCRYPT_ROUNDS={rounds}")
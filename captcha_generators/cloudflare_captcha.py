@@ -3,53 +3,67 @@ Cloudflare-style Captcha Generator
 Simulates Cloudflare Turnstile with test token verification
 """
 
-import random
-import string
 import time
-import hashlib
+import hmac
+import secrets
+import threading
+from collections import OrderedDict
 
 
 class CloudflareCaptcha:
     def __init__(self):
-        self.valid_tokens: dict[str, dict] = {}
+        # Tokens share one TTL, so insertion order is also expiry order
+        self.valid_tokens: OrderedDict[str, dict] = OrderedDict()
         self.token_expiry = 300  # 5 minutes
+        self._lock = threading.Lock()
         
     def generate_challenge_id(self):
         """Generate a unique challenge ID"""
-        timestamp = str(time.time())
-        random_str = ''.join(random.choices(string.ascii_letters + string.digits, k=16))
-        return hashlib.sha256(f"{timestamp}{random_str}".encode()).hexdigest()[:32]
+        return secrets.token_hex(16)
     
     def generate_token(self, challenge_id):
         """Generate a verification token for a challenge"""
-        token_data = f"{challenge_id}{time.time()}{random.random()}"
-        token = hashlib.sha256(token_data.encode()).hexdigest()
+        token = secrets.token_hex(32)
         
-        # Store token with expiry
-        self.valid_tokens[token] = {
-            'challenge_id': challenge_id,
-            'created_at': time.time(),
-            'expires_at': time.time() + self.token_expiry
-        }
+        # Store token with expiry, indexed by its prefix so verification
+        # can do a constant-time compare on the full value
+        created_at = time.time()
+        expires_at = created_at + self.token_expiry
+        token_key = token[:16]
+        with self._lock:
+            self.valid_tokens[token_key] = {
+                'token': token,
+                'challenge_id': challenge_id,
+                'created_at': created_at,
+                'expires_at': expires_at
+            }
         
         return token
     
     def verify_token(self, token):
         """Verify if a token is valid"""
-        # Clean expired tokens
+        if not isinstance(token, str):
+            token = str(token)
+        token_key = token[:16]
         current_time = time.time()
-        self.valid_tokens = {
-            k: v for k, v in self.valid_tokens.items() 
-            if v['expires_at'] > current_time
-        }
         
-        if token in self.valid_tokens:
-            # Token is valid - remove it (one-time use)
-            self.valid_tokens.pop(token)
-            return {
-                'success': True,
-                'message': 'Verification successful'
-            }
+        with self._lock:
+            # Clean expired tokens (only the ones at the front of the queue)
+            while self.valid_tokens:
+                oldest = next(iter(self.valid_tokens.values()))
+                if oldest['expires_at'] > current_time:
+                    break
+                self.valid_tokens.popitem(last=False)
+            
+            entry = self.valid_tokens.get(token_key)
+            if (entry and entry['expires_at'] > current_time
+                    and hmac.compare_digest(entry['token'].encode(), token.encode())):
+                # Token is valid - remove it (one-time use)
+                self.valid_tokens.pop(token_key)
+                return {
+                    'success': True,
+                    'message': 'Verification successful'
+                }
         
         return {
             'success': False,
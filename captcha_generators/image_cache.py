@@ -4,14 +4,58 @@ Stores and retrieves cached images to reduce Unsplash API calls
 """
 
 import os
+import atexit
+import heapq
 import random
-import hashlib
+import re
+import secrets
 import json
-from datetime import datetime, timedelta
+import pickle
+import threading
+import time
+from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
 from PIL import Image
 
 
+_IMG_SUFFIXES = ('.jpg', '.png')
+
+# Characters not allowed in category directory names
+_SANITIZE_RE = re.compile(r'[^A-Za-z0-9_-]')
+
+# Number of most recent accesses tracked per image for LRU-K eviction
+_LRU_K = 2
+
+# Minimum seconds between metadata writes; saves in between are coalesced
+_METADATA_FLUSH_INTERVAL = 2.0
+
+# Minimum seconds between full expiry walks in cleanup_all
+_CLEANUP_MIN_INTERVAL = 3600
+
+
+@lru_cache(maxsize=256)
+def _load_decoded(path_str, mtime, size):
+    """
+    Decode (and optionally resize) a cached image to raw RGB pixels
+    
+    Keyed by mtime so a rewritten file is decoded again.
+    
+    Returns:
+        Tuple of (size, RGB bytes)
+    """
+    img = Image.open(path_str)
+    if size:
+        # Let the JPEG decoder downscale in the DCT domain first
+        img.draft('RGB', size)
+    img = img.convert('RGB')
+    
+    if size:
+        img = img.resize(size, Image.Resampling.LANCZOS)
+        
+    return img.size, img.tobytes()
+
+
 class ImageCache:
     def __init__(self, cache_dir=None, max_images_per_category=20, cache_expiry_days=7):
         """
@@ -29,13 +73,29 @@ class ImageCache:
         self.cache_dir = Path(cache_dir)
         self.max_images_per_category = max_images_per_category
         self.cache_expiry_days = cache_expiry_days
-        self.metadata_file = self.cache_dir / 'cache_metadata.json'
+        self.metadata_file = self.cache_dir / 'cache_metadata.pkl'
+        # Pre-pickle metadata location, read once for migration
+        self.legacy_metadata_file = self.cache_dir / 'cache_metadata.json'
+        
+        # Directory listings keyed by category dir -> (dir mtime, image paths)
+        self._listing_cache = {}
+        
+        # Sanitized, already-created category dirs keyed by category name
+        self._dir_cache: dict[str, Path] = {}
+        
+        # Guards metadata updates; the cache is shared across request/prefetch threads
+        self._lock = threading.RLock()
         
         # Ensure cache directory exists
         self._ensure_cache_dir()
         
         # Load metadata
         self.metadata = self._load_metadata()
+        self._metadata_dirty = False
+        self._last_flush = time.monotonic()
+        
+        # Flush any coalesced metadata changes on interpreter exit
+        atexit.register(self._flush_on_exit)
         
     def _ensure_cache_dir(self):
         """Create cache directory if it doesn't exist"""
@@ -43,29 +103,117 @@ class ImageCache:
         
     def _get_category_dir(self, category):
         """Get the directory path for a specific category"""
-        # Sanitize category name for filesystem
-        safe_category = "".join(c if c.isalnum() or c in ('-', '_') else '_' for c in category)
-        category_dir = self.cache_dir / safe_category
-        category_dir.mkdir(parents=True, exist_ok=True)
+        category_dir = self._dir_cache.get(category)
+        if category_dir is not None:
+            return category_dir
+            
+        with self._lock:
+            # Sanitize category name for filesystem
+            safe_category = _SANITIZE_RE.sub('_', category)
+            category_dir = self.cache_dir / safe_category
+            category_dir.mkdir(parents=True, exist_ok=True)
+            self._dir_cache[category] = category_dir
         return category_dir
         
+    def _list_images(self, category_dir):
+        """List cached image files in a category dir, reusing the last scan while the dir mtime is unchanged"""
+        try:
+            mtime = category_dir.stat().st_mtime
+        except FileNotFoundError:
+            # Dir removed behind our back; recreate it on the next lookup
+            self._dir_cache = {k: v for k, v in self._dir_cache.items() if v != category_dir}
+            return []
+        cached = self._listing_cache.get(category_dir)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        
+        with os.scandir(category_dir) as entries:
+            image_files = [
+                Path(entry.path) for entry in entries
+                if entry.name.endswith(_IMG_SUFFIXES) and entry.is_file()
+            ]
+        
+        self._listing_cache[category_dir] = (mtime, image_files)
+        return image_files
+        
+    def _access_history(self, category):
+        """Get the per-file access history ({filename: [timestamps]}) for a category"""
+        category_meta = self.metadata['categories'].setdefault(category, {})
+        return category_meta.setdefault('access_history', {})
+        
+    def _record_access(self, category, file_paths):
+        """Append an access timestamp to each file's history, keeping the last K"""
+        now = time.time()
+        with self._lock:
+            history = self._access_history(category)
+            for file_path in file_paths:
+                accesses = history.setdefault(file_path.name, [])
+                accesses.append(now)
+                del accesses[:-_LRU_K]
+            self._metadata_dirty = True
+        
     def _load_metadata(self):
-        """Load cache metadata from file"""
+        """Load cache metadata from file, migrating the legacy JSON file if needed"""
         if self.metadata_file.exists():
             try:
-                with open(self.metadata_file, 'r') as f:
-                    return json.load(f)
+                with open(self.metadata_file, 'rb') as f:
+                    return pickle.load(f)
             except:
-                return {'categories': {}, 'last_cleanup': None}
+                pass
+                
+        if self.legacy_metadata_file.exists():
+            try:
+                with open(self.legacy_metadata_file, 'r') as f:
+                    return self._migrate_legacy_metadata(json.load(f))
+            except:
+                pass
+                
         return {'categories': {}, 'last_cleanup': None}
         
-    def _save_metadata(self):
-        """Save cache metadata to file"""
-        try:
-            with open(self.metadata_file, 'w') as f:
-                json.dump(self.metadata, f, indent=2, default=str)
-        except Exception as e:
-            print(f"Error saving cache metadata: {e}")
+    @staticmethod
+    def _migrate_legacy_metadata(metadata):
+        """Convert ISO-format timestamps from the JSON metadata to float epoch seconds"""
+        def to_timestamp(value):
+            if isinstance(value, str):
+                try:
+                    return datetime.fromisoformat(value).timestamp()
+                except ValueError:
+                    return None
+            return value
+            
+        metadata.setdefault('categories', {})
+        metadata['last_cleanup'] = to_timestamp(metadata.get('last_cleanup'))
+        for category_meta in metadata['categories'].values():
+            if 'last_updated' in category_meta:
+                category_meta['last_updated'] = to_timestamp(category_meta['last_updated'])
+        return metadata
+        
+    def _save_metadata(self, force=False):
+        """
+        Save cache metadata to file
+        
+        Writes are coalesced: unless force is set, the metadata is only marked
+        dirty if the last write happened less than _METADATA_FLUSH_INTERVAL ago.
+        """
+        with self._lock:
+            self._metadata_dirty = True
+            if not force and time.monotonic() - self._last_flush < _METADATA_FLUSH_INTERVAL:
+                return
+                
+            tmp_file = self.metadata_file.with_name(self.metadata_file.name + '.tmp')
+            try:
+                with open(tmp_file, 'wb') as f:
+                    pickle.dump(self.metadata, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_file, self.metadata_file)
+                self._metadata_dirty = False
+                self._last_flush = time.monotonic()
+            except Exception as e:
+                print(f"Error saving cache metadata: {e}")
+            
+    def _flush_on_exit(self):
+        """Write out pending metadata changes, if any"""
+        if self._metadata_dirty:
+            self._save_metadata(force=True)
             
     def get_cached_images(self, category, count=1, size=None):
         """
@@ -80,9 +228,11 @@ class ImageCache:
             List of PIL Image objects (may be less than count if cache is small)
         """
         category_dir = self._get_category_dir(category)
+        if size:
+            size = tuple(size)
         
         # Get list of cached images
-        image_files = list(category_dir.glob('*.jpg')) + list(category_dir.glob('*.png'))
+        image_files = self._list_images(category_dir)
         
         if not image_files:
             return []
@@ -93,13 +243,8 @@ class ImageCache:
         images = []
         for file_path in selected_files:
             try:
-                img = Image.open(file_path)
-                img = img.convert('RGB')
-                
-                if size:
-                    img = img.resize(size, Image.Resampling.LANCZOS)
-                    
-                images.append(img)
+                img_size, pixels = _load_decoded(str(file_path), file_path.stat().st_mtime, size)
+                images.append(Image.frombytes('RGB', img_size, pixels))
             except Exception as e:
                 print(f"Error loading cached image {file_path}: {e}")
                 # Remove corrupted file
@@ -107,14 +252,15 @@ class ImageCache:
                     file_path.unlink()
                 except:
                     pass
+                self._listing_cache.pop(category_dir, None)
                     
+        self._record_access(category, selected_files)
         return images
         
     def get_cache_count(self, category):
         """Get the number of cached images for a category"""
         category_dir = self._get_category_dir(category)
-        image_files = list(category_dir.glob('*.jpg')) + list(category_dir.glob('*.png'))
-        return len(image_files)
+        return len(self._list_images(category_dir))
         
     def has_enough_cached(self, category, min_count=5):
         """Check if category has enough cached images"""
@@ -136,7 +282,7 @@ class ImageCache:
         
         # Generate unique filename
         if image_id is None:
-            image_id = hashlib.md5(f"{datetime.now().isoformat()}{random.random()}".encode()).hexdigest()[:12]
+            image_id = secrets.token_hex(6)
             
         filename = f"{image_id}.jpg"
         file_path = category_dir / filename
@@ -146,21 +292,34 @@ class ImageCache:
             if image.mode != 'RGB':
                 image = image.convert('RGB')
                 
-            image.save(file_path, 'JPEG', quality=85)
-            
-            # Update metadata
-            if category not in self.metadata['categories']:
-                self.metadata['categories'][category] = {
-                    'count': 0,
-                    'last_updated': None
-                }
-            
-            self.metadata['categories'][category]['count'] = self.get_cache_count(category)
-            self.metadata['categories'][category]['last_updated'] = datetime.now().isoformat()
-            self._save_metadata()
+            # Write to a unique temp name and swap it in atomically, so concurrent
+            # writers of the same id and readers never see a half-written JPEG
+            tmp_path = category_dir / f".{filename}.{secrets.token_hex(4)}.tmp"
+            try:
+                image.save(tmp_path, 'JPEG', quality=85)
+                os.replace(tmp_path, file_path)
+            except BaseException:
+                tmp_path.unlink(missing_ok=True)
+                raise
+            self._listing_cache.pop(category_dir, None)
             
-            # Cleanup if over limit
-            self._cleanup_category(category)
+            with self._lock:
+                # Update metadata, keeping a running count instead of re-scanning
+                # the directory (seeded from disk the first time a category is seen)
+                category_meta = self.metadata['categories'].setdefault(category, {})
+                if 'count' in category_meta:
+                    category_meta['count'] += 1
+                else:
+                    category_meta['count'] = self.get_cache_count(category)
+                category_meta['last_updated'] = time.time()
+                self._record_access(category, [file_path])
+                
+                # Cleanup if over limit; only then reconcile the count with a real scan
+                if category_meta['count'] > self.max_images_per_category:
+                    self._cleanup_category(category, self._list_images(category_dir),
+                                           protect=file_path)
+                    
+                self._save_metadata()
             
             return str(file_path)
             
@@ -168,43 +327,92 @@ class ImageCache:
             print(f"Error saving image to cache: {e}")
             return None
             
-    def _cleanup_category(self, category):
-        """Remove oldest images if category exceeds max limit"""
+    def _cleanup_category(self, category, image_files=None, protect=None):
+        """
+        Remove oldest images if category exceeds max limit
+        
+        Args:
+            category: Image category/query
+            image_files: Optional already-enumerated image paths for the category
+            protect: Optional path that must not be evicted (the image just saved)
+        """
         category_dir = self._get_category_dir(category)
-        image_files = list(category_dir.glob('*.jpg')) + list(category_dir.glob('*.png'))
+        if image_files is None:
+            image_files = self._list_images(category_dir)
+            
+        with self._lock:
+            category_meta = self.metadata['categories'].get(category)
+            if category_meta is not None:
+                category_meta['count'] = min(len(image_files), self.max_images_per_category)
         
-        if len(image_files) > self.max_images_per_category:
-            # Sort by modification time (oldest first)
-            image_files.sort(key=lambda x: x.stat().st_mtime)
+        files_to_remove = len(image_files) - self.max_images_per_category
+        if files_to_remove > 0:
+            # LRU-K: files seen fewer than K times go first (oldest last access
+            # first), then files ordered by their K-th most recent access. Files
+            # without any recorded history fall back to their mtime.
+            history = self._access_history(category)
+            candidates = []
+            for file_path in image_files:
+                # A fresh save has a single access and would otherwise always
+                # rank first for eviction, so the cache could never take in
+                # anything new once full
+                if file_path == protect:
+                    continue
+                accesses = history.get(file_path.name)
+                if not accesses:
+                    try:
+                        accesses = [file_path.stat().st_mtime]
+                    except OSError:
+                        continue
+                if len(accesses) >= _LRU_K:
+                    key = (1, accesses[-_LRU_K])
+                else:
+                    key = (0, accesses[-1])
+                candidates.append((key, file_path))
+            victims = heapq.nsmallest(files_to_remove, candidates, key=lambda item: item[0])
             
-            # Remove oldest files
-            files_to_remove = len(image_files) - self.max_images_per_category
-            for file_path in image_files[:files_to_remove]:
+            # Remove evicted files
+            for _, file_path in victims:
                 try:
                     file_path.unlink()
                 except:
                     pass
+                history.pop(file_path.name, None)
+            self._listing_cache.pop(category_dir, None)
+            
+            # Forget history for files removed outside of eviction
+            live_names = {file_path.name for file_path in image_files}
+            for name in [name for name in history if name not in live_names]:
+                del history[name]
                     
     def cleanup_all(self):
-        """Clean up all expired cache entries"""
+        """Clean up all expired cache entries (at most once per _CLEANUP_MIN_INTERVAL)"""
         if not self.cache_dir.exists():
             return
             
-        cutoff_date = datetime.now() - timedelta(days=self.cache_expiry_days)
+        last_cleanup = self.metadata.get('last_cleanup')
+        if last_cleanup and time.time() - last_cleanup < _CLEANUP_MIN_INTERVAL:
+            return
+            
+        cutoff_ts = time.time() - self.cache_expiry_days * 86400
+        
+        with os.scandir(self.cache_dir) as category_entries:
+            category_dirs = [e.path for e in category_entries
+                             if e.is_dir() and e.name != '__pycache__']
         
-        for category_dir in self.cache_dir.iterdir():
-            if category_dir.is_dir() and category_dir.name != '__pycache__':
-                for file_path in category_dir.glob('*'):
-                    if file_path.is_file() and file_path.suffix in ('.jpg', '.png'):
+        for category_dir in category_dirs:
+            with os.scandir(category_dir) as entries:
+                for entry in entries:
+                    if entry.name.endswith(_IMG_SUFFIXES) and entry.is_file():
                         try:
-                            mtime = datetime.fromtimestamp(file_path.stat().st_mtime)
-                            if mtime < cutoff_date:
-                                file_path.unlink()
+                            if entry.stat().st_mtime < cutoff_ts:
+                                os.unlink(entry.path)
                         except:
                             pass
                             
-        self.metadata['last_cleanup'] = datetime.now().isoformat()
-        self._save_metadata()
+        with self._lock:
+            self.metadata['last_cleanup'] = time.time()
+            self._save_metadata(force=True)
         
     def get_stats(self):
         """Get cache statistics"""
@@ -214,12 +422,14 @@ class ImageCache:
             'cache_dir': str(self.cache_dir)
         }
         
-        for category_dir in self.cache_dir.iterdir():
-            if category_dir.is_dir() and category_dir.name != '__pycache__':
-                image_files = list(category_dir.glob('*.jpg')) + list(category_dir.glob('*.png'))
-                count = len(image_files)
-                stats['categories'][category_dir.name] = count
-                stats['total_images'] += count
+        with os.scandir(self.cache_dir) as category_entries:
+            category_dirs = [Path(e.path) for e in category_entries
+                             if e.is_dir() and e.name != '__pycache__']
+        
+        for category_dir in category_dirs:
+            count = len(self._list_images(category_dir))
+            stats['categories'][category_dir.name] = count
+            stats['total_images'] += count
                 
         return stats
 
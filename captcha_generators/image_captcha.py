@@ -6,13 +6,33 @@ Uses Unsplash API for real images with fallback to generated shapes
 
 import random
 import io
+import math
 import base64
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image, ImageDraw, ImageFont
 import os
 
 from .unsplash_client import unsplash_client
 
 
+# Sun ray offsets from the center: (inner x, inner y, outer x, outer y) every 45 degrees
+SUN_RAYS = [
+    (35 * math.cos(math.radians(angle)), 35 * math.sin(math.radians(angle)),
+     50 * math.cos(math.radians(angle)), 50 * math.sin(math.radians(angle)))
+    for angle in range(0, 360, 45)
+]
+
+# Flower petal center offsets, five petals starting at the top
+FLOWER_PETALS = [
+    (20 * math.cos(math.radians(i * 72 - 90)), 20 * math.sin(math.radians(i * 72 - 90)))
+    for i in range(5)
+]
+
+# Shared pool for rendering grid tiles; PIL releases the GIL in its C code
+_TILE_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix='captcha-tile')
+
+
 class ImageCaptcha:
     def __init__(self):
         # Define image categories with search queries for Unsplash
@@ -30,6 +50,13 @@ class ImageCaptcha:
         }
         self.use_unsplash = True  # Use Unsplash API for real images
         
+        # Noise-free fallback drawings keyed by (category, color, size);
+        # the default 120px set is rendered up front
+        self._shape_cache = {}
+        for category, info in self.categories.items():
+            for color in info['colors']:
+                self._get_category_shape(category, color)
+        
     def set_api_key(self, api_key):
         """Set the Unsplash API key"""
         unsplash_client.set_api_key(api_key)
@@ -43,11 +70,31 @@ class ImageCaptcha:
         images = unsplash_client.get_images_by_query(query, count=1, size=(size, size))
         return images[0] if images else None
         
+    def _get_category_shape(self, category, color, size=120):
+        """Get the noise-free drawing for a category/color as a pixel array (cached)"""
+        key = (category, color, size)
+        pixels = self._shape_cache.get(key)
+        if pixels is None:
+            pixels = np.array(self._draw_category_shape(category, color, size))
+            self._shape_cache[key] = pixels
+        return pixels
+        
     def generate_category_image(self, category, size=120):
         """Generate a simple representative image for a category"""
         colors = self.categories[category]['colors']
         color = random.choice(colors)
+        pixels = self._get_category_shape(category, color, size).copy()
         
+        # Add some texture/noise: shift 50 random pixels by the same amount on all channels
+        ys = np.random.randint(0, size, 50)
+        xs = np.random.randint(0, size, 50)
+        variation = np.random.randint(-15, 16, (50, 1), dtype=np.int16)
+        pixels[ys, xs] = np.clip(pixels[ys, xs].astype(np.int16) + variation, 0, 255).astype(np.uint8)
+        
+        return Image.fromarray(pixels)
+        
+    def _draw_category_shape(self, category, color, size=120):
+        """Draw the simple representative shape for a category"""
         image = Image.new('RGB', (size, size), (245, 245, 250))
         draw = ImageDraw.Draw(image)
         
@@ -74,13 +121,8 @@ class ImageCaptcha:
         elif category == 'sun':
             # Draw a simple sun
             draw.ellipse([35, 35, 85, 85], fill=color)
-            for angle in range(0, 360, 45):
-                import math
-                x1 = 60 + 35 * math.cos(math.radians(angle))
-                y1 = 60 + 35 * math.sin(math.radians(angle))
-                x2 = 60 + 50 * math.cos(math.radians(angle))
-                y2 = 60 + 50 * math.sin(math.radians(angle))
-                draw.line([(x1, y1), (x2, y2)], fill=color, width=3)
+            for x1, y1, x2, y2 in SUN_RAYS:
+                draw.line([(60 + x1, 60 + y1), (60 + x2, 60 + y2)], fill=color, width=3)
                 
         elif category == 'mountain':
             # Draw a simple mountain
@@ -91,34 +133,39 @@ class ImageCaptcha:
             # Draw a simple flower
             draw.ellipse([50, 70, 70, 100], fill=(34, 139, 34))  # stem
             draw.rectangle([58, 70, 62, 100], fill=(34, 139, 34))
-            for i in range(5):
-                import math
-                cx = 60 + 20 * math.cos(math.radians(i * 72 - 90))
-                cy = 50 + 20 * math.sin(math.radians(i * 72 - 90))
+            for dx, dy in FLOWER_PETALS:
+                cx, cy = 60 + dx, 50 + dy
                 draw.ellipse([cx-12, cy-12, cx+12, cy+12], fill=color)
             draw.ellipse([50, 40, 70, 60], fill=(255, 255, 0))
         
-        # Add some texture/noise
-        for _ in range(50):
-            x = random.randint(0, size-1)
-            y = random.randint(0, size-1)
-            r, g, b = image.getpixel((x, y))
-            variation = random.randint(-15, 15)
-            new_color = (
-                max(0, min(255, r + variation)),
-                max(0, min(255, g + variation)),
-                max(0, min(255, b + variation))
-            )
-            draw.point((x, y), fill=new_color)
-        
         return image
     
     def image_to_base64(self, image):
-        """Convert PIL image to base64 string"""
+        """Convert PIL image to base64 string (JPEG for opaque RGB, fast PNG otherwise)"""
         buffer = io.BytesIO()
-        image.save(buffer, format='PNG')
-        buffer.seek(0)
-        return f"data:image/png;base64,{base64.b64encode(buffer.getvalue()).decode('utf-8')}"
+        if image.mode == 'RGB':
+            image.save(buffer, format='JPEG', quality=78)
+            prefix = b'data:image/jpeg;base64,'
+        else:
+            image.save(buffer, format='PNG', compress_level=1)
+            prefix = b'data:image/png;base64,'
+        # Encode straight from the buffer's memory instead of copying it out first
+        return (prefix + base64.b64encode(buffer.getbuffer())).decode('ascii')
+    
+    def _render_tile(self, slot):
+        """Build the grid entry for one (index, category, is_correct, image) slot"""
+        i, cat, is_correct, img = slot
+        
+        # Fall back to a generated image when Unsplash gave us nothing
+        if img is None:
+            img = self.generate_category_image(cat)
+            
+        return {
+            'image': self.image_to_base64(img),
+            'category': cat,
+            'is_correct': is_correct,
+            'index': i
+        }
     
     def generate(self):
         """Generate image captcha with 9 images in a 3x3 grid, 3 being correct answers"""
@@ -141,29 +188,35 @@ class ImageCaptcha:
         # Randomly assign which positions get correct images
         correct_indices = random.sample(range(9), 3)
         
-        images = []
+        slots = []
         wrong_idx = 0
         
         for i in range(9):
             if i in correct_indices:
-                cat = target_category
-                is_correct = True
+                slots.append((i, target_category, True))
             else:
-                cat = selected_wrong[wrong_idx]
+                slots.append((i, selected_wrong[wrong_idx], False))
                 wrong_idx += 1
-                is_correct = False
-            
-            # Try Unsplash first, fallback to generated image
-            img = self.fetch_unsplash_image(cat)
-            if img is None:
-                img = self.generate_category_image(cat)
-                
-            images.append({
-                'image': self.image_to_base64(img),
-                'category': cat,
-                'is_correct': is_correct,
-                'index': i
-            })
+        
+        # Try Unsplash once per distinct category in parallel. Distinct queries never
+        # race each other, and the first fetch fills the cache for repeats.
+        distinct = list(dict.fromkeys(cat for _, cat, _ in slots))
+        first_images = dict(zip(distinct, _TILE_EXECUTOR.map(self.fetch_unsplash_image, distinct)))
+        
+        tiles = []
+        seen = set()
+        for i, cat, is_correct in slots:
+            if cat not in seen:
+                seen.add(cat)
+                img = first_images[cat]
+            elif first_images[cat] is not None:
+                img = self.fetch_unsplash_image(cat)  # served from the now-warm cache
+            else:
+                img = None  # Unsplash gave nothing for this category
+            tiles.append((i, cat, is_correct, img))
+        
+        # Render and encode the tiles concurrently, keeping grid order
+        images = list(_TILE_EXECUTOR.map(self._render_tile, tiles))
         
         return {
             'target': target_category,
@@ -7,16 +7,32 @@ Uses Unsplash API for background images with fallback to generated patterns
 import random
 import io
 import base64
-from PIL import Image, ImageDraw, ImageFilter, ImageEnhance
-import math
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter, ImageEnhance, ImageFont
 
 from .unsplash_client import unsplash_client
 
 
+# Font for the numbered hole indicators, loaded once instead of on every draw
+_LABEL_FONT = ImageFont.load_default()
+
+
 class PuzzleCaptcha:
     def __init__(self):
         self.puzzle_size = 300
         self.piece_size = 60
+        
+        # Sliding piece geometry depends only on piece_size, so build it once
+        canvas = self.piece_size + 20
+        self._piece_canvas_size = (canvas, canvas)
+        self._piece_rect = (10, 10, self.piece_size + 10, self.piece_size + 10)
+        # Puzzle-piece shaped mask: main square plus a tab on the right
+        yy, xx = np.ogrid[:canvas, :canvas]
+        self._piece_mask = np.zeros(self._piece_canvas_size, dtype=bool)
+        self._piece_mask[10:self.piece_size + 11, 10:self.piece_size + 11] = True
+        self._piece_mask |= ((xx - (self.piece_size + 10)) / 10.5) ** 2 + ((yy - 40) / 15.5) ** 2 <= 1
+        self._piece_alpha = self._piece_mask.astype(np.uint8) * 255
+        
         self.use_unsplash = True  # Try to use Unsplash by default
         # Search queries for interesting background images
         self.background_queries = [
@@ -47,19 +63,16 @@ class PuzzleCaptcha:
         
     def generate_background_image(self, size=300):
         """Generate a colorful abstract background (fallback)"""
-        image = Image.new('RGB', (size, size), (100, 150, 200))
-        draw = ImageDraw.Draw(image)
-        
         # Create gradient background
-        for y in range(size):
-            for x in range(size):
-                r = int(100 + 80 * math.sin(x / 30) + 50 * math.cos(y / 40))
-                g = int(120 + 60 * math.cos(x / 25) + 40 * math.sin(y / 35))
-                b = int(180 - 30 * math.sin((x + y) / 50))
-                r = max(0, min(255, r))
-                g = max(0, min(255, g))
-                b = max(0, min(255, b))
-                draw.point((x, y), fill=(r, g, b))
+        xs = np.arange(size, dtype=np.float32)
+        ys = xs[:, None]
+        xs = xs[None, :]
+        r = 100 + 80 * np.sin(xs / 30) + 50 * np.cos(ys / 40)
+        g = 120 + 60 * np.cos(xs / 25) + 40 * np.sin(ys / 35)
+        b = 180 - 30 * np.sin((xs + ys) / 50)
+        channels = [np.clip(c, 0, 255).astype(np.uint8) for c in np.broadcast_arrays(r, g, b)]
+        image = Image.fromarray(np.dstack(channels))
+        draw = ImageDraw.Draw(image)
         
         # Add some shapes
         for _ in range(5):
@@ -88,11 +101,16 @@ class PuzzleCaptcha:
         return background
     
     def image_to_base64(self, image):
-        """Convert PIL image to base64 string"""
+        """Convert PIL image to base64 string (JPEG for opaque RGB, fast PNG otherwise)"""
         buffer = io.BytesIO()
-        image.save(buffer, format='PNG')
-        buffer.seek(0)
-        return f"data:image/png;base64,{base64.b64encode(buffer.getvalue()).decode('utf-8')}"
+        if image.mode == 'RGB':
+            image.save(buffer, format='JPEG', quality=78)
+            prefix = b'data:image/jpeg;base64,'
+        else:
+            image.save(buffer, format='PNG', compress_level=1)
+            prefix = b'data:image/png;base64,'
+        # Encode straight from the buffer's memory instead of copying it out first
+        return (prefix + base64.b64encode(buffer.getbuffer())).decode('ascii')
     
     def generate_sliding_puzzle(self):
         """
@@ -106,46 +124,26 @@ class PuzzleCaptcha:
         piece_y = random.randint(50, self.puzzle_size - self.piece_size - 50)
         correct_x = random.randint(100, self.puzzle_size - self.piece_size - 50)
         
-        # Create the puzzle piece (with puzzle-piece shape)
-        piece_img = Image.new('RGBA', (self.piece_size + 20, self.piece_size + 20), (0, 0, 0, 0))
-        piece_draw = ImageDraw.Draw(piece_img)
-        
-        # Draw puzzle piece shape
-        # Main square
-        piece_draw.rectangle([10, 10, self.piece_size + 10, self.piece_size + 10], 
-                            fill=(255, 255, 255, 255))
-        # Tab on right
-        piece_draw.ellipse([self.piece_size, 25, self.piece_size + 20, 55], 
-                          fill=(255, 255, 255, 255))
-        
-        # Create mask for the piece
-        mask = piece_img.split()[3]
-        
-        # Extract the piece from background
-        piece_content = background.crop((correct_x - 10, piece_y - 10, 
-                                         correct_x + self.piece_size + 10, 
-                                         piece_y + self.piece_size + 10))
-        piece_content = piece_content.convert('RGBA')
-        
-        # Apply mask
-        piece_final = Image.new('RGBA', piece_content.size, (0, 0, 0, 0))
-        piece_final.paste(piece_content, mask=mask)
+        # Extract the piece from background and apply the mask as its alpha channel
+        bg_pixels = np.array(background)
+        # (every pixel of the uninitialized buffer is written below)
+        piece_rgba = np.empty(self._piece_canvas_size + (4,), dtype=np.uint8)
+        piece_rgba[..., :3] = bg_pixels[piece_y - 10:piece_y + self.piece_size + 10,
+                                        correct_x - 10:correct_x + self.piece_size + 10]
+        piece_rgba[..., 3] = self._piece_alpha
+        piece_rgba[~self._piece_mask, :3] = 0
+        piece_final = Image.fromarray(piece_rgba, 'RGBA')
         
         # Add shadow to piece
-        shadow = Image.new('RGBA', piece_final.size, (0, 0, 0, 0))
+        shadow = Image.new('RGBA', self._piece_canvas_size, (0, 0, 0, 0))
         shadow_draw = ImageDraw.Draw(shadow)
-        shadow_draw.rectangle([10, 10, self.piece_size + 10, self.piece_size + 10], 
-                             fill=(0, 0, 0, 80))
+        shadow_draw.rectangle(self._piece_rect, fill=(0, 0, 0, 80))
         
-        # Create the background with hole
-        bg_with_hole = background.copy()
+        # Create the background with hole, darkening the hole area
+        # (slicing clamps to the image bounds)
+        bg_pixels[piece_y:piece_y + self.piece_size, correct_x:correct_x + self.piece_size] //= 2
+        bg_with_hole = Image.fromarray(bg_pixels)
         bg_draw = ImageDraw.Draw(bg_with_hole)
-        # Draw semi-transparent overlay on the hole
-        for x in range(correct_x, correct_x + self.piece_size):
-            for y in range(piece_y, piece_y + self.piece_size):
-                if 0 <= x < self.puzzle_size and 0 <= y < self.puzzle_size:
-                    r, g, b = bg_with_hole.getpixel((x, y))
-                    bg_with_hole.putpixel((x, y), (r // 2, g // 2, b // 2))
         
         # Draw hole outline
         bg_draw.rectangle([correct_x, piece_y, 
@@ -171,6 +169,7 @@ class PuzzleCaptcha:
         """
         # Generate background (Unsplash with fallback to generated)
         background = self.get_background(self.puzzle_size)
+        bg_pixels = np.array(background)
         
         # Define 3 piece positions
         positions = []
@@ -193,40 +192,39 @@ class PuzzleCaptcha:
                 'y': y
             })
             
-            # Extract piece from background
-            piece_img = background.crop((x, y, x + self.piece_size, y + self.piece_size))
-            
-            # Add border to piece
-            piece_with_border = Image.new('RGB', 
-                                         (self.piece_size + 4, self.piece_size + 4), 
-                                         (255, 255, 255))
-            piece_with_border.paste(piece_img, (2, 2))
+            # Extract piece from background with a 2px white border
+            # (uninitialized buffer: the border and interior fills cover every pixel)
+            piece_with_border = np.empty((self.piece_size + 4, self.piece_size + 4, 3), dtype=np.uint8)
+            piece_with_border[:2] = 255
+            piece_with_border[-2:] = 255
+            piece_with_border[:, :2] = 255
+            piece_with_border[:, -2:] = 255
+            piece_with_border[2:-2, 2:-2] = bg_pixels[y:y + self.piece_size, x:x + self.piece_size]
             
             pieces.append({
                 'id': idx,
-                'image': self.image_to_base64(piece_with_border),
+                'image': self.image_to_base64(Image.fromarray(piece_with_border, 'RGB')),
                 'correct_x': x,
                 'correct_y': y
             })
         
-        # Create background with holes
-        bg_with_holes = background.copy()
+        # Create background with holes: mark every hole area, then darken them in one pass
+        # (slicing clamps to the image bounds)
+        hole_mask = np.zeros(bg_pixels.shape[:2], dtype=bool)
+        for pos in positions:
+            x, y = pos['x'], pos['y']
+            hole_mask[y:y + self.piece_size, x:x + self.piece_size] = True
+        bg_pixels[hole_mask] //= 3
+        bg_with_holes = Image.fromarray(bg_pixels)
         bg_draw = ImageDraw.Draw(bg_with_holes)
         
         for pos in positions:
             x, y = pos['x'], pos['y']
-            # Darken the hole area
-            for px in range(x, x + self.piece_size):
-                for py in range(y, y + self.piece_size):
-                    if 0 <= px < self.puzzle_size and 0 <= py < self.puzzle_size:
-                        r, g, b = bg_with_holes.getpixel((px, py))
-                        bg_with_holes.putpixel((px, py), (r // 3, g // 3, b // 3))
-            
             # Draw numbered indicator
             bg_draw.rectangle([x, y, x + self.piece_size, y + self.piece_size],
                              outline=(255, 255, 255), width=2)
-            bg_draw.text((x + self.piece_size // 2 - 5, y + self.piece_size // 2 - 8),
-                        str(pos['id'] + 1), fill=(255, 255, 255))
+            bg_draw.text((x + self.piece_size // 2, y + self.piece_size // 2),
+                        str(pos['id'] + 1), fill=(255, 255, 255), font=_LABEL_FONT, anchor='mm')
         
         # Shuffle pieces order for display
         random.shuffle(pieces)
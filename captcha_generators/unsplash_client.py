@@ -6,7 +6,9 @@ Fetches images from Unsplash for captcha generation with local caching
 import os
 import random
 import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from io import BytesIO
+from requests.adapters import HTTPAdapter
 from PIL import Image
 
 from .image_cache import image_cache
@@ -19,12 +21,21 @@ class UnsplashClient:
     # Minimum cached images before fetching from API
     MIN_CACHE_THRESHOLD = 5
     
+    # (connect, read) timeouts so a slow Unsplash response can't stall a captcha
+    REQUEST_TIMEOUT = (2, 4)
+    
     def __init__(self, api_key=None):
         self.api_key = api_key or os.environ.get('UNSPLASH_API_KEY') or self.DEFAULT_API_KEY
         self.base_url = "https://api.unsplash.com"
         self.use_cache = True  # Enable caching by default
         self.cache_only_mode = False  # Allow API calls, cache results for faster subsequent loads
         
+        # Pooled session so API calls and image downloads reuse TCP/TLS connections
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=16, max_retries=1)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        
     def set_api_key(self, api_key):
         """Set the API key"""
         self.api_key = api_key
@@ -70,11 +81,11 @@ class UnsplashClient:
             if query:
                 params['query'] = query
                 
-            response = requests.get(
+            response = self.session.get(
                 f"{self.base_url}/photos/random",
                 headers=headers,
                 params=params,
-                timeout=5
+                timeout=self.REQUEST_TIMEOUT
             )
             
             if response.status_code == 200:
@@ -141,30 +152,35 @@ class UnsplashClient:
                 'orientation': 'squarish'
             }
             
-            response = requests.get(
+            response = self.session.get(
                 f"{self.base_url}/search/photos",
                 headers=headers,
                 params=params,
-                timeout=5
+                timeout=self.REQUEST_TIMEOUT
             )
             
             if response.status_code == 200:
                 data = response.json()
                 results = data.get('results', [])
                 
+                # Download all results concurrently
                 images = []
-                for photo in results:
-                    image_url = photo.get('urls', {}).get('small') or photo.get('urls', {}).get('thumb')
-                    image_id = photo.get('id', '')
-                    
-                    if image_url:
-                        img = self._download_and_resize(image_url, size)
+                with ThreadPoolExecutor(max_workers=8) as executor:
+                    futures = {}
+                    for photo in results:
+                        image_url = photo.get('urls', {}).get('small') or photo.get('urls', {}).get('thumb')
+                        if image_url:
+                            future = executor.submit(self._download_and_resize, image_url, size)
+                            futures[future] = photo.get('id', '')
+                            
+                    for future in as_completed(futures):
+                        img = future.result()
                         if img:
                             images.append(img)
                             
                             # Cache the image
                             if self.use_cache:
-                                image_cache.save_image(img, category, image_id)
+                                image_cache.save_image(img, category, futures[future])
                             
                 return images[:count]
             else:
@@ -180,11 +196,18 @@ class UnsplashClient:
     def _download_and_resize(self, url, size):
         """Download image from URL and resize it"""
         try:
-            response = requests.get(url, timeout=10)
+            response = self.session.get(url, timeout=self.REQUEST_TIMEOUT)
             if response.status_code == 200:
                 img = Image.open(BytesIO(response.content))
+                # Let the JPEG decoder downscale to about twice the target first
+                img.draft('RGB', (size[0] * 2, size[1] * 2))
                 img = img.convert('RGB')
-                img = img.resize(size, Image.Resampling.LANCZOS)
+                # Captcha-sized targets don't benefit visibly from LANCZOS
+                if max(size) <= 256:
+                    resample = Image.Resampling.BILINEAR
+                else:
+                    resample = Image.Resampling.LANCZOS
+                img = img.resize(size, resample)
                 return img
         except Exception as e:
             print(f"Error downloading image: {e}")
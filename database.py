@@ -4,11 +4,83 @@ SQLite database with User model for authentication
 """
 
 from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime
+from sqlalchemy import bindparam, event, func, or_, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from werkzeug.security import check_password_hash
+import hashlib
+import hmac
+import os
+import sqlite3
+import threading
+
+import bcrypt
+from cachetools import TTLCache
 
 db = SQLAlchemy()
 
+# bcrypt work factor; tune per host with calibrate_bcrypt.py (~250ms per hash)
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+
+
+def _prehash(password):
+    """SHA-256 hex digest of the password, sidestepping bcrypt's 72-byte/NUL limits"""
+    return hashlib.sha256(password.encode('utf-8')).hexdigest().encode('ascii')
+
+
+def _ct_eq(a, b):
+    """Constant-time bytes equality: XOR-accumulate every byte, no early exit"""
+    result = len(a) ^ len(b)
+    for x, y in zip(a, b):
+        result |= x ^ y
+    return result == 0
+
+
+# Prefer the C implementation; stripped-down Pythons may not ship it
+_compare_digest = getattr(hmac, 'compare_digest', _ct_eq)
+
+
+def constant_time_compare(a, b):
+    """Compare two strings or byte strings in time independent of where they differ"""
+    if isinstance(a, str):
+        a = a.encode('utf-8')
+    if isinstance(b, str):
+        b = b.encode('utf-8')
+    return _compare_digest(a, b)
+
+
+# Opt-in memo of successful password checks, for deployments that re-verify the
+# same API-token-style secret on every request. Leave unset (0) for interactive
+# logins so each attempt pays the full bcrypt cost.
+PASSWORD_CHECK_CACHE_TTL = int(os.environ.get('PASSWORD_CHECK_CACHE_TTL', 0))
+_password_check_cache = (TTLCache(maxsize=10_000, ttl=PASSWORD_CHECK_CACHE_TTL)
+                         if PASSWORD_CHECK_CACHE_TTL > 0 else None)
+_password_check_lock = threading.Lock()
+
+
+def _verify_password(password_hash, password):
+    """Check a password against a bcrypt hash, or a legacy Werkzeug hash"""
+    if _password_check_cache is not None:
+        key = (password_hash, hashlib.sha256(password.encode('utf-8')).digest())
+        with _password_check_lock:
+            if key in _password_check_cache:
+                return True
+    
+    if password_hash.startswith(b'$2'):
+        ok = bcrypt.checkpw(_prehash(password), password_hash)
+    else:
+        ok = check_password_hash(password_hash.decode('ascii'), password)
+    
+    # Only matches are remembered, so wrong guesses can't flush real entries
+    if ok and _password_check_cache is not None:
+        with _password_check_lock:
+            _password_check_cache[key] = True
+    return ok
+
+
+# Verified against when a login names an unknown user, so the miss costs a full hash too
+_DUMMY_HASH = bcrypt.hashpw(_prehash('x' * 16), bcrypt.gensalt(rounds=BCRYPT_ROUNDS))
+
 
 class User(db.Model):
     """User model for authentication"""
@@ -17,8 +89,9 @@ class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False, index=True)
     email = db.Column(db.String(120), unique=True, nullable=False, index=True)
-    password_hash = db.Column(db.String(256), nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Raw bcrypt bytes, handed to bcrypt without any str round-trip
+    password_hash = db.Column(db.LargeBinary(256), nullable=False)
+    created_at = db.Column(db.DateTime, server_default=func.current_timestamp(), nullable=False)
     is_active = db.Column(db.Boolean, default=True)
     
     def __repr__(self):
@@ -26,37 +99,181 @@ class User(db.Model):
     
     def set_password(self, password):
         """Hash and set password"""
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = bcrypt.hashpw(_prehash(password), bcrypt.gensalt(rounds=BCRYPT_ROUNDS))
         
     def check_password(self, password):
         """Verify password against hash"""
-        return check_password_hash(self.password_hash, password)
+        return _verify_password(self.password_hash, password)
+    
+    @staticmethod
+    def needs_rehash(password_hash):
+        """True if a stored hash is legacy or weaker than BCRYPT_ROUNDS"""
+        if not password_hash.startswith(b'$2'):
+            return True
+        # bcrypt hashes look like $2b$<cost>$<salt+hash>
+        return int(password_hash.split(b'$')[2]) < BCRYPT_ROUNDS
     
     @staticmethod
     def get_by_username(username):
         """Find user by username"""
-        return User.query.filter_by(username=username).first()
+        return db.session.execute(_USER_BY_USERNAME, {'username': username}).scalar_one_or_none()
     
     @staticmethod
     def get_by_email(email):
         """Find user by email"""
-        return User.query.filter_by(email=email).first()
+        return db.session.execute(_USER_BY_EMAIL, {'email': email}).scalar_one_or_none()
     
     @staticmethod
     def get_by_username_or_email(identifier):
         """Find user by username or email"""
-        return User.query.filter(
-            (User.username == identifier) | (User.email == identifier)
-        ).first()
+        return db.session.execute(_USER_BY_IDENT, {'ident': identifier}).scalar_one_or_none()
+    
+    @staticmethod
+    def get_for_auth(identifier):
+        """Fetch just (id, username, password_hash, is_active) by username or email"""
+        with _auth_cache_lock:
+            row = _auth_cache.get(identifier, _NOT_CACHED)
+        if row is _NOT_CACHED:
+            row = db.session.execute(_AUTH_BY_IDENT, {'ident': identifier}).first()
+            # Misses are cached too, so known and unknown identifiers both skip
+            # the SELECT and take the same time once warm
+            with _auth_cache_lock:
+                _auth_cache[identifier] = row
+        return row
+    
+    @staticmethod
+    def authenticate(identifier, password):
+        """Return the auth row if the password matches, else None, in similar time either way"""
+        row = User.get_for_auth(identifier)
+        if row is None:
+            bcrypt.checkpw(_prehash(password), _DUMMY_HASH)
+            return None
+        return row if _verify_password(row.password_hash, password) else None
+
+
+# Lookup statements built once so their compiled SQL is reused from the cache
+_USER_BY_USERNAME = select(User).where(User.username == bindparam('username')).limit(1)
+_USER_BY_EMAIL = select(User).where(User.email == bindparam('email')).limit(1)
+_IDENT_MATCH = or_(User.username == bindparam('ident'), User.email == bindparam('ident'))
+_USER_BY_IDENT = select(User).where(_IDENT_MATCH).limit(1)
+# Login only needs these columns, so skip email/created_at and the ORM object
+_AUTH_BY_IDENT = select(
+    User.id, User.username, User.password_hash, User.is_active
+).where(_IDENT_MATCH).limit(1)
+
+
+# Recent auth rows keyed by the username or email used to look them up; None
+# records a lookup that found nobody. Rows are plain tuples, so they outlive the
+# session that loaded them. The cache is per process: commits here clear the
+# affected entries, but other workers (e.g. several gunicorn processes) can serve
+# a changed password, deactivation or new account up to the TTL (60s) late.
+_auth_cache = TTLCache(maxsize=1024, ttl=60)
+_auth_cache_lock = threading.Lock()
+_NOT_CACHED = object()
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_stale_auth_keys(session, flush_context):
+    """Remember which users a flush touched, to drop their cache entries on commit"""
+    stale = session.info.setdefault('stale_auth', set())
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, User):
+            # id covers renames and password changes; username/email clear the
+            # negative entries left by lookups made before the account existed
+            stale.update((('id', obj.id), ('ident', obj.username), ('ident', obj.email)))
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_auth_cache(session):
+    """Drop cached auth rows for users changed by the transaction that just committed"""
+    # Done after commit rather than at flush, so a concurrent login can't
+    # re-cache the old row from the still-uncommitted database state
+    stale = session.info.pop('stale_auth', None)
+    if not stale:
+        return
+    ids = {value for kind, value in stale if kind == 'id'}
+    with _auth_cache_lock:
+        for kind, value in stale:
+            if kind == 'ident':
+                _auth_cache.pop(value, None)
+        for key in [key for key, row in _auth_cache.items() if row is not None and row.id in ids]:
+            _auth_cache.pop(key, None)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_stale_auth_keys(session):
+    """Nothing was committed, so the cache is still accurate"""
+    session.info.pop('stale_auth', None)
+
+
+# Applied to every new SQLite connection: WAL with relaxed fsyncs, a 64MB page
+# cache and 256MB of memory-mapped reads
+SQLITE_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA cache_size=-65536',
+    'PRAGMA mmap_size=268435456',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA foreign_keys=ON',
+)
+
+
+@event.listens_for(Engine, 'connect')
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Tune SQLite connections as they are opened"""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
 
 
 def init_db(app):
     """Initialize database with the Flask app"""
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///captcha_users.db'
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # Keep a pool of open connections shared across requests and worker threads
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'echo': False,
+        'pool_size': 10,
+        'max_overflow': 20,
+        'connect_args': {'check_same_thread': False, 'timeout': 5},
+    }
     
     db.init_app(app)
     
     with app.app_context():
         db.create_all()
+        # The unique username/email indexes already pin login lookups to one
+        # row, so SQLite never picked these; drop them from older databases
+        for name in ('ix_users_username_active', 'ix_users_email_active'):
+            db.session.execute(text(f'DROP INDEX IF EXISTS {name}'))
+        db.session.commit()
+        _add_created_at_default()
+        _migrate_password_hash_to_blob()
         print("Database initialized successfully!")
+
+
+def _add_created_at_default():
+    """Give users tables created before server_default a created_at fill-in trigger"""
+    # SQLite can't add a column default without rebuilding the table, so older
+    # tables get a trigger that stamps rows inserted without a created_at
+    columns = db.session.execute(text('PRAGMA table_info(users)')).mappings()
+    if any(col['name'] == 'created_at' and col['dflt_value'] is None for col in columns):
+        db.session.execute(text(
+            'CREATE TRIGGER IF NOT EXISTS users_created_at_default '
+            'AFTER INSERT ON users WHEN NEW.created_at IS NULL BEGIN '
+            'UPDATE users SET created_at = CURRENT_TIMESTAMP WHERE id = NEW.id; END'
+        ))
+        db.session.commit()
+
+
+def _migrate_password_hash_to_blob():
+    """Convert password hashes stored as TEXT by older versions to BLOB"""
+    # Safe to run on every start: rows already stored as BLOB are skipped
+    db.session.execute(text(
+        "UPDATE users SET password_hash = CAST(password_hash AS BLOB) "
+        "WHERE typeof(password_hash) = 'text'"
+    ))
+    db.session.commit()
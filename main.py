@@ -5,14 +5,46 @@ Run this file to start the application
 """
 
 import os
+import socket
+import subprocess
 import sys
-import webbrowser
-from threading import Timer
+import threading
+import time
+
+APP_URL = 'http://127.0.0.1:5000'
 
 
 def open_browser():
-    """Open the browser to the application URL"""
-    webbrowser.open('http://127.0.0.1:5000')
+    """Open the browser to the application URL without waiting for it"""
+    try:
+        if sys.platform == 'win32':
+            os.startfile(APP_URL)
+        elif sys.platform == 'darwin':
+            subprocess.Popen(['open', APP_URL])
+        else:
+            subprocess.Popen(['xdg-open', APP_URL], start_new_session=True,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    except OSError:
+        # No system opener available - let webbrowser find something
+        import webbrowser
+        webbrowser.open(APP_URL)
+
+
+def open_browser_when_ready(timeout=30):
+    """Open the browser in the background once the server accepts connections"""
+    def wait_and_open():
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                with socket.create_connection(('127.0.0.1', 5000), timeout=0.5):
+                    break
+            except OSError:
+                time.sleep(0.2)
+        else:
+            return
+        open_browser()
+    
+    threading.Thread(target=wait_and_open, daemon=True).start()
 
 
 def main():
@@ -25,24 +57,38 @@ def main():
     # Check if we should open browser automatically
     auto_open = '--no-browser' not in sys.argv
     
-    if auto_open:
-        print("📌 Opening browser in 2 seconds...")
-        Timer(2, open_browser).start()
-    
-    print("🌐 Starting server at http://127.0.0.1:5000")
+    print(f"🌐 Starting server at {APP_URL}")
     print("📝 Press Ctrl+C to stop the server")
     print()
     
     # Import and run the Flask app
     from app import app
+    from flask.helpers import get_debug_flag
     
-    # Run the Flask development server
-    app.run(
-        host='127.0.0.1',
-        port=5000,
-        debug=True,
-        use_reloader=True
-    )
+    # Same parsing as Flask itself, so FLASK_DEBUG=0/false keeps debug off
+    if get_debug_flag():
+        # The reloader re-runs this script in a child process that binds the port
+        # only after re-importing everything, so wait for it (from the parent only)
+        if auto_open and not os.environ.get('WERKZEUG_RUN_MAIN'):
+            open_browser_when_ready()
+        
+        # Flask development server with debugger and auto-reload
+        app.run(
+            host='127.0.0.1',
+            port=5000,
+            debug=True,
+            use_reloader=True
+        )
+    else:
+        # Threaded production server so captcha rendering overlaps across requests
+        # (for multiple processes: gunicorn -w <cpus> -k gthread app:app)
+        from waitress import create_server
+        server = create_server(app, host='127.0.0.1', port=5000, threads=8, connection_limit=1000)
+        
+        # The socket is listening now, so the browser's first request can't miss
+        if auto_open:
+            open_browser()
+        server.run()
 
 
 if __name__ == '__main__':
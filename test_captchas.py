@@ -1,37 +1,202 @@
-"""Test all captcha generators"""
-from captcha_generators.text_captcha import TextCaptcha
-from captcha_generators.image_captcha import ImageCaptcha
-from captcha_generators.cloudflare_captcha import CloudflareCaptcha
-from captcha_generators.puzzle_captcha import PuzzleCaptcha
-from captcha_generators.audio_captcha import AudioCaptcha
-
-print('Testing TextCaptcha...')
-tc = TextCaptcha()
-result = tc.generate()
-print(f'  Text length: {len(result["text"])}, Image generated: {len(result["image"]) > 100}')
-
-print('Testing ImageCaptcha...')
-ic = ImageCaptcha()
-result = ic.generate()
-print(f'  Prompt: {result["prompt"][:30]}..., Images: {len(result["images"])}')
-
-print('Testing CloudflareCaptcha...')
-cc = CloudflareCaptcha()
-result = cc.generate()
-print(f'  Challenge ID: {result["challenge_id"][:16]}...')
-
-print('Testing PuzzleCaptcha (sliding)...')
-pc = PuzzleCaptcha()
-result = pc.generate_sliding_puzzle()
-print(f'  Correct X: {result["correct_x"]}, Piece Y: {result["piece_y"]}')
-
-print('Testing PuzzleCaptcha (drag)...')
-result = pc.generate_drag_puzzle()
-print(f'  Pieces: {len(result["pieces"])}, Positions: {len(result["positions"])}')
-
-print('Testing AudioCaptcha...')
-ac = AudioCaptcha()
-result = ac.generate()
-print(f'  Text length: {len(result["text"])}, Audio generated: {len(result["audio"]) > 100}')
-
-print('ALL TESTS PASSED!')
+"""Test and benchmark all captcha generators (pytest + pytest-benchmark)"""
+import contextlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+from sqlalchemy import event
+
+# Generators and the database module are imported inside the fixtures/tests that
+# use them, so collecting this file (pytest --collect-only, IDE discovery) doesn't
+# pay for font preloading, shape rendering or the bcrypt dummy hash
+
+
+@contextlib.contextmanager
+def count_queries(conn):
+    """Collect the SQL statements executed on conn while the block runs"""
+    queries = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        queries.append(statement)
+
+    event.listen(conn, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield queries
+    finally:
+        event.remove(conn, 'before_cursor_execute', before_cursor_execute)
+
+
+# Generators are built once per module so font/asset loading is not timed
+
+@pytest.fixture(scope='module')
+def text_captcha():
+    from captcha_generators.text_captcha import TextCaptcha
+    return TextCaptcha()
+
+
+@pytest.fixture(scope='module')
+def image_captcha():
+    from captcha_generators.image_captcha import ImageCaptcha
+    captcha = ImageCaptcha()
+    captcha.use_unsplash = False  # keep network latency out of the numbers
+    return captcha
+
+
+@pytest.fixture(scope='module')
+def cloudflare_captcha():
+    from captcha_generators.cloudflare_captcha import CloudflareCaptcha
+    return CloudflareCaptcha()
+
+
+@pytest.fixture(scope='module')
+def puzzle_captcha():
+    from captcha_generators.puzzle_captcha import PuzzleCaptcha
+    captcha = PuzzleCaptcha()
+    captcha.use_unsplash = False  # keep network latency out of the numbers
+    return captcha
+
+
+@pytest.fixture(scope='module')
+def audio_captcha():
+    from captcha_generators.audio_captcha import AudioCaptcha
+    return AudioCaptcha()
+
+
+def test_text_captcha(benchmark, text_captcha):
+    result = benchmark(text_captcha.generate)
+    assert len(result['text']) == 6
+    assert len(result['image']) > 100
+
+
+def test_image_captcha(benchmark, image_captcha):
+    result = benchmark(image_captcha.generate)
+    assert len(result['images']) == 9
+    assert len(result['correct_indices']) == 3
+
+
+def test_cloudflare_captcha(benchmark, cloudflare_captcha):
+    result = benchmark(cloudflare_captcha.generate)
+    assert len(result['challenge_id']) >= 16
+
+
+@pytest.mark.parametrize('method', ['generate_sliding_puzzle', 'generate_drag_puzzle'])
+def test_puzzle_captcha(benchmark, puzzle_captcha, method):
+    result = benchmark(getattr(puzzle_captcha, method))
+    assert result['piece_size'] == puzzle_captcha.piece_size
+    if method == 'generate_drag_puzzle':
+        assert len(result['pieces']) == len(result['positions']) == 3
+
+
+def test_audio_captcha(benchmark, audio_captcha):
+    result = benchmark(audio_captcha.generate)
+    assert len(result['text']) > 0
+    assert len(result['audio']) > 100
+
+
+def test_login_query_count():
+    from flask import Flask
+    import database
+    from database import db, User
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        user = User(username='alice', email='alice@example.com')
+        user.set_password('correct horse')
+        db.session.add(user)
+        db.session.commit()
+
+        with count_queries(db.session.connection()) as queries:
+            User.get_by_username_or_email('alice')
+        assert len(queries) == 1, queries
+
+        # The auth cache is module-global, so start cold regardless of test order
+        database._auth_cache.clear()
+        with count_queries(db.session.connection()) as queries:
+            assert User.authenticate('alice@example.com', 'correct horse') is not None
+        assert len(queries) == 1, queries
+
+        # Repeat logins are served from the cache
+        with count_queries(db.session.connection()) as queries:
+            assert User.authenticate('alice@example.com', 'correct horse') is not None
+        assert len(queries) == 0, queries
+
+        # Unknown identifiers are cached too, so they cost the same as known ones
+        with count_queries(db.session.connection()) as queries:
+            assert User.authenticate('mallory', 'guess') is None
+        assert len(queries) == 1, queries
+        with count_queries(db.session.connection()) as queries:
+            assert User.authenticate('mallory', 'guess') is None
+        assert len(queries) == 0, queries
+
+
+def test_image_cache_keeps_newly_saved_image(tmp_path):
+    from PIL import Image
+    from captcha_generators.image_cache import ImageCache
+
+    cache = ImageCache(cache_dir=tmp_path, max_images_per_category=3)
+    for i in range(3):
+        cache.save_image(Image.new('RGB', (8, 8)), 'cat', f'a{i}')
+    assert len(cache.get_cached_images('cat', count=3)) == 3
+
+    # Every old image has now been read once; the new one must still survive eviction
+    saved = cache.save_image(Image.new('RGB', (8, 8)), 'cat', 'new')
+    names = sorted(p.name for p in (tmp_path / 'cat').glob('*.jpg'))
+    assert saved is not None and os.path.exists(saved)
+    assert 'new.jpg' in names and len(names) == 3
+
+
+# ---- Quick smoke run: python test_captchas.py ----
+# Each check is a module-level function so it can be pickled to a worker process
+
+def smoke_text():
+    from captcha_generators.text_captcha import TextCaptcha
+    result = TextCaptcha().generate()
+    return 'TextCaptcha', f'Text length: {len(result["text"])}, Image generated: {len(result["image"]) > 100}'
+
+
+def smoke_image():
+    from captcha_generators.image_captcha import ImageCaptcha
+    result = ImageCaptcha().generate()
+    return 'ImageCaptcha', f'Prompt: {result["prompt"][:30]}..., Images: {len(result["images"])}'
+
+
+def smoke_cloudflare():
+    from captcha_generators.cloudflare_captcha import CloudflareCaptcha
+    result = CloudflareCaptcha().generate()
+    return 'CloudflareCaptcha', f'Challenge ID: {result["challenge_id"][:16]}...'
+
+
+def smoke_puzzle():
+    from captcha_generators.puzzle_captcha import PuzzleCaptcha
+    pc = PuzzleCaptcha()
+    sliding = pc.generate_sliding_puzzle()
+    drag = pc.generate_drag_puzzle()
+    return 'PuzzleCaptcha', (f'Correct X: {sliding["correct_x"]}, Piece Y: {sliding["piece_y"]}, '
+                             f'Drag pieces: {len(drag["pieces"])}')
+
+
+def smoke_audio():
+    from captcha_generators.audio_captcha import AudioCaptcha
+    result = AudioCaptcha().generate()
+    return 'AudioCaptcha', f'Text length: {len(result["text"])}, Audio generated: {len(result["audio"]) > 100}'
+
+
+def _run_check(check):
+    return check()
+
+
+def main():
+    """Run the generator smoke checks in parallel worker processes"""
+    checks = [smoke_text, smoke_image, smoke_cloudflare, smoke_puzzle, smoke_audio]
+    with ProcessPoolExecutor(max_workers=len(checks)) as executor:
+        for name, summary in executor.map(_run_check, checks):
+            print(f'Testing {name}...')
+            print(f'  {summary}')
+    print('ALL TESTS PASSED!')
+
+
+if __name__ == '__main__':
+    main()